@@ -3,34 +3,109 @@ import sys
 import platform
 import hashlib
 import csv
+import codecs
 import argparse
+import mmap
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-def hashlib_md5(filename):
+SMALL_FILE_SIZE = 256 * 1024  # Files smaller than this are hashed with a single read
+CHUNK_SIZE = 16 * 1024 * 1024  # Size of each read or mmap view handed to the hash object
+PROGRESS_INTERVAL = 1.0  # Seconds between progress lines for large files
+DEFAULT_JOBS = 2  # Files hashed at once; more than a couple makes spinning disks and NAS shares seek
+
+try:
+    import blake3
+except ImportError:
+    # blake3 is an optional dependency, only needed for --algo blake3
+    blake3 = None
+
+HASH_LABELS = {'md5': 'MD5', 'blake2b': 'BLAKE2b', 'blake3': 'BLAKE3'}
+
+def new_hash(algo):
+    """Returns a fresh hash object for the given algorithm name."""
+    if algo == 'blake3':
+        return blake3.blake3()
+    return hashlib.new(algo)
+
+def iter_mapped_chunks(mapped):
+    """Yields a mapped file in CHUNK_SIZE memoryview slices."""
+    with mapped:
+        can_advise = hasattr(mapped, 'madvise')
+        if can_advise:
+            mapped.madvise(mmap.MADV_SEQUENTIAL)
+        with memoryview(mapped) as view:
+            for offset in range(0, len(view), CHUNK_SIZE):
+                if can_advise and offset + CHUNK_SIZE < len(view):
+                    # Prefetch only the next chunk, not the whole file, so large files aren't
+                    # pulled into the page cache far ahead of the hasher and evicted again
+                    mapped.madvise(mmap.MADV_WILLNEED, offset + CHUNK_SIZE, CHUNK_SIZE)
+                # Release each slice before the next one so the map can be closed afterwards
+                with view[offset:offset + CHUNK_SIZE] as chunk:
+                    yield chunk
+
+def iter_chunks(file_object, use_mmap=False):
+    """Yields the contents of an open file in CHUNK_SIZE pieces, through mmap if use_mmap is set."""
+    if use_mmap:
+        # Opt-in only: if a mapped file shrinks or its drive fails mid-read the process gets SIGBUS,
+        # which kills the whole run instead of raising OSError
+        try:
+            mapped = mmap.mmap(file_object.fileno(), 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            mapped = None  # Some files can't be mapped, so stream them instead
+        if mapped is not None:
+            yield from iter_mapped_chunks(mapped)
+            return
+    if hasattr(os, 'posix_fadvise'):
+        try:
+            # Let the kernel read ahead of us while the previous chunk is being hashed
+            os.posix_fadvise(file_object.fileno(), 0, 0, os.POSIX_FADV_SEQUENTIAL)
+        except OSError:
+            pass
+    # Read into one reusable buffer rather than allocating a new bytes object per chunk
+    buf = bytearray(CHUNK_SIZE)
+    with memoryview(buf) as view:
+        while True:
+            read_size = file_object.readinto(view)
+            if not read_size:
+                break
+            with view[:read_size] as chunk:
+                yield chunk
+
+def hash_file(filename, algo='md5', total_size=None, cancel=None, use_mmap=False):
     '''
-    Create an md5 checksum.
+    Create a checksum with the given algorithm.
+    Returns None if the cancel event is set before the file is finished.
     '''
-    read_size = 0
-    last_percent_done = 0
-    md5_object = hashlib.md5()
-    total_size = os.path.getsize(filename)
-    print(f'Generating md5 checksum for {os.path.basename(filename)}')
+    label = HASH_LABELS[algo]
+    hash_object = new_hash(algo)
+    print(f'Generating {label} checksum for {os.path.basename(filename)}')
     with open(str(filename), 'rb') as file_object:
-        while True:
-            buf = file_object.read(2**20)
-            if not buf:
-                break
-            read_size += len(buf)
-            md5_object.update(buf)
-            percent_done = 100 * read_size / total_size
-            if percent_done > last_percent_done:
-                sys.stdout.write('[%d%%]\r' % percent_done)
-                sys.stdout.flush()
-                last_percent_done = percent_done
-    md5_output = md5_object.hexdigest()
-    print(f'Calculated md5 checksum is {md5_output}\n')
-    return md5_output
-
-## The function above, hashlib_md5 is a slightly modified version of the function from the open-source project IFIscripts
+        if total_size is None:
+            total_size = os.fstat(file_object.fileno()).st_size
+        if total_size < SMALL_FILE_SIZE:
+            hash_object.update(file_object.read())
+        elif use_mmap and hasattr(hash_object, 'update_mmap'):
+            # blake3 maps the file itself and hashes it without copying
+            hash_object.update_mmap(filename)
+        else:
+            read_size = 0
+            last_report = time.monotonic()
+            for chunk in iter_chunks(file_object, use_mmap):
+                if cancel is not None and cancel.is_set():
+                    return None  # The run is being abandoned, stop between chunks
+                hash_object.update(chunk)
+                read_size += len(chunk)
+                now = time.monotonic()
+                if now - last_report >= PROGRESS_INTERVAL:
+                    sys.stderr.write(f'{os.path.basename(filename)} [{100 * read_size // total_size}%]\n')
+                    last_report = now
+    hash_output = hash_object.hexdigest()
+    print(f'Calculated {label} checksum for {os.path.basename(filename)} is {hash_output}\n')
+    return hash_output
+
+## The function above, hash_file is a slightly modified version of the hashlib_md5 function from the open-source project IFIscripts
 ## More here: https://github.com/Irish-Film-Institute/IFIscripts/blob/master/scripts/copyit.py
 ## IFIscripts license information below:
 # The MIT License (MIT)
@@ -46,60 +121,148 @@ def hashlib_md5(filename):
 # all copies or substantial portions of the Software.
 
 
-def is_hidden_file(filepath):
+def is_hidden_file(filepath, name=None):
     """Checks if a file is hidden on macOS or Windows."""
-    name = os.path.basename(filepath)
+    if name is None:
+        name = os.path.basename(filepath)
     return (
         name.startswith('.')  # macOS hidden files start with '.'
         or has_hidden_attribute(filepath)  # Windows hidden files have the 'hidden' attribute
     )
 
-def has_hidden_attribute(filepath):
-    """Checks if a file has the 'hidden' attribute on Windows."""
-    if platform.system() == 'Windows':
+# Look up the platform and win32api once at import, not on every file checked
+win32api = None
+if platform.system() == 'Windows':
+    try:
+        import win32con, win32api
+    except ImportError:
+        # win32api might not be available on all Windows installations
+        win32api = None
+
+if win32api is not None:
+    def has_hidden_attribute(filepath):
+        """Checks if a file has the 'hidden' attribute on Windows."""
+        attrs = win32api.GetFileAttributes(filepath)
+        return attrs & win32con.FILE_ATTRIBUTE_HIDDEN != 0
+else:
+    def has_hidden_attribute(filepath):
+        """Checks if a file has the 'hidden' attribute on Windows."""
+        return False  # Not on Windows, or win32api isn't installed
+
+def iter_files(directory):
+    """
+    Yields a DirEntry for every regular file under a directory, in the same order as os.walk.
+    Unlike os.walk, broken symlinks, FIFOs and device files are left out, since they can't be hashed.
+    """
+    try:
+        with os.scandir(directory) as entries:
+            entries = list(entries)
+    except OSError as error:
+        sys.stderr.write(f'Skipping unreadable directory {directory}: {error}\n')
+        return
+    subdirs = []
+    for entry in entries:
         try:
-            import win32con, win32api
-            attrs = win32api.GetFileAttributes(filepath)
-            return attrs & win32con.FILE_ATTRIBUTE_HIDDEN != 0
-        except ImportError:
-            # win32api might not be available on all Windows installations
-            return False
-    else:
-        return False  # Not on Windows
+            if entry.is_dir(follow_symlinks=False):
+                subdirs.append(entry.path)
+            elif entry.is_file():
+                yield entry
+        except OSError as error:
+            sys.stderr.write(f'Skipping {entry.path}: {error}\n')
+    for subdir in subdirs:
+        yield from iter_files(subdir)
 
-def process_path(path, csv_writer):
-    """Processes a given file or directory, adding checksums to the CSV, ignoring hidden files."""
+def collect_files(path):
+    """Returns (path, size) pairs for the non-hidden files under a given file or directory."""
+    files = []
     if os.path.isfile(path):
-        if not is_hidden_file(path):  # Check if the file is hidden
-            checksum = hashlib_md5(path)
-            row_data = {'Filename': path, 'MD5 Checksum': checksum}
-            csv_writer.writerow(row_data)
+        if not is_hidden_file(path):
+            try:
+                files.append((path, os.path.getsize(path)))
+            except OSError as error:
+                sys.stderr.write(f'Skipping {path}: {error}\n')
     elif os.path.isdir(path):
-        for root, _, files in os.walk(path):
-            for file in files:
-                filepath = os.path.join(root, file)
-                if not is_hidden_file(filepath):  # Check if the file is hidden
-                    checksum = hashlib_md5(filepath)
-                    row_data = {'Filename': filepath, 'MD5 Checksum': checksum}
-                    csv_writer.writerow(row_data)
+        for entry in iter_files(path):
+            if is_hidden_file(entry.path, entry.name):  # Check if the file is hidden
+                continue
+            try:
+                files.append((entry.path, entry.stat().st_size))
+            except OSError as error:
+                # The file vanished or can't be stat'ed, skip it rather than abort the whole walk
+                sys.stderr.write(f'Skipping {entry.path}: {error}\n')
+    return files
+
+def process_path(path, csv_writer, algo='md5', jobs=DEFAULT_JOBS, use_mmap=False):
+    """Processes a given file or directory, adding checksums to the CSV, ignoring hidden files."""
+    files = collect_files(path)
+    cancel = threading.Event()
+    # hashlib releases the GIL while digesting large buffers, so files hash concurrently across threads
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(hash_file, filepath, algo, size, cancel, use_mmap) for filepath, size in files]
+        try:
+            for (filepath, _), future in zip(files, futures):
+                # Written as soon as each checksum is ready, and main opens the CSV line-buffered,
+                # so finished rows reach the file even if the process is killed
+                csv_writer.writerow([filepath, future.result()])  # Same column order as the header written in main
+        except BaseException:
+            # On Ctrl-C or an error, drop queued files and have running ones stop at their next chunk
+            cancel.set()
+            for future in futures:
+                future.cancel()
+            raise
+
+def is_utf8_file(filename):
+    """Checks if a file's contents decode as UTF-8."""
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    with open(filename, 'rb') as file_object:
+        try:
+            for block in iter(lambda: file_object.read(CHUNK_SIZE), b''):
+                decoder.decode(block)
+            decoder.decode(b'', final=True)
+        except UnicodeDecodeError:
+            return False
+    return True
 
 def main():
     """Main function to handle command-line arguments and script execution."""
-    parser = argparse.ArgumentParser(description="Collect MD5 checksums of files and directories.")
+    parser = argparse.ArgumentParser(description="Collect checksums of files and directories.")
     parser.add_argument("path", help="File or directory to process")
+    parser.add_argument("--algo", choices=sorted(HASH_LABELS), default="md5",
+                        help="Checksum algorithm to use (default: md5)")
+    parser.add_argument("--jobs", type=int, default=DEFAULT_JOBS,
+                        help=f"Number of files to hash at once (default: {DEFAULT_JOBS}, "
+                             "raise it for SSDs, keep it low for spinning disks, tape and network storage)")
+    parser.add_argument("--mmap", action="store_true",
+                        help="Hash large files through mmap. Only for local disks: if a mapped file shrinks "
+                             "or its drive errors mid-read, the whole run is killed by SIGBUS")
     args = parser.parse_args()
 
+    if args.jobs < 1:
+        parser.error("--jobs must be at least 1")
+    if args.algo == "blake3" and blake3 is None:
+        parser.error("--algo blake3 requires the blake3 package (pip install blake3)")
+
     csv_filename = "checksums.csv"
-    file_exists = os.path.isfile(csv_filename)
+    fieldnames = ["Filename", f"{HASH_LABELS[args.algo]} Checksum"]
+    header = None
+    if os.path.isfile(csv_filename):
+        if not is_utf8_file(csv_filename):
+            # Older versions wrote the CSV in the locale encoding (e.g. cp1252 on Windows), don't mix the two
+            parser.error(f"{csv_filename} is not UTF-8 encoded, move it aside so a new UTF-8 file can be started")
+        with open(csv_filename, newline="", encoding="utf-8", errors="replace") as existing:
+            header = next(csv.reader(existing), None)
+    if header and header != fieldnames:
+        # Don't mix algorithms in one CSV, the column name is what tells them apart
+        parser.error(f"{csv_filename} already holds '{header[-1]}' values, move it aside to collect {args.algo} checksums")
 
-    with open(csv_filename, "a", newline="") as csvfile:
-        fieldnames = ["Filename", "MD5 Checksum"]
-        writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+    # Line-buffered: one write per row is nothing next to hashing the file, and no finished row sits in memory
+    with open(csv_filename, "a", newline="", buffering=1, encoding="utf-8") as csvfile:
+        writer = csv.writer(csvfile)
 
-        if not file_exists:
-            writer.writeheader()
+        if not header:
+            writer.writerow(fieldnames)
 
-        process_path(args.path, writer)
+        process_path(args.path, writer, args.algo, args.jobs, args.mmap)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file